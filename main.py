@@ -7,7 +7,9 @@ import argparse
 import os
 import time
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from lxml import etree
 import preprocessing as preproc
 import processing as proc
 import postprocessing as postproc
@@ -16,19 +18,40 @@ def compare_documents(doc1_path, doc2_path, algorithm, output_dir):
     """
     Compares two XML documents and generates output.
     """
-    # Validate input documents
-    if not all(preproc.validate_xml(doc) for doc in [doc1_path, doc2_path]):
-        raise ValueError("Invalid XML document(s)")
-
     # Create output subdirectories
+    analysis_dir, documents_dir = _make_output_dirs(output_dir)
+    
+    return _compare_documents_fast(doc1_path, doc2_path, algorithm, analysis_dir, documents_dir,
+                                   os.path.basename(doc1_path))
+
+def _make_output_dirs(output_dir):
+    """
+    Creates and returns the analysis and documents output subdirectories.
+    """
     analysis_dir = os.path.join(output_dir, 'analysis')
     documents_dir = os.path.join(output_dir, 'documents')
     os.makedirs(analysis_dir, exist_ok=True)
     os.makedirs(documents_dir, exist_ok=True)
+    return analysis_dir, documents_dir
 
-    # Preprocess both documents
-    tree1 = preproc.preprocess_xml(doc1_path, algorithm=algorithm)
-    tree2 = preproc.preprocess_xml(doc2_path, algorithm=algorithm)
+def _compare_documents_fast(doc1_path, doc2_path, algorithm, analysis_dir, documents_dir,
+                            doc1_name, tree1=None):
+    """
+    Compares two XML documents into existing output subdirectories.
+    Skips directory setup, which the caller has done. An already
+    preprocessed tree1 can be passed to skip reprocessing doc1.
+    """
+    # Preprocess both documents into one label table scoped to this comparison;
+    # parsing also validates them
+    try:
+        if tree1 is None:
+            labels = preproc.LabelTable()
+            tree1 = preproc.preprocess_xml(doc1_path, algorithm=algorithm, labels=labels)
+        else:
+            labels = tree1.labels.copy()
+        tree2 = preproc.preprocess_xml(doc2_path, algorithm=algorithm, labels=labels)
+    except etree.XMLSyntaxError:
+        raise ValueError("Invalid XML document(s)")
     
     # Get tree statistics
     stats1 = preproc.get_tree_stats(tree1)
@@ -40,7 +63,6 @@ def compare_documents(doc1_path, doc2_path, algorithm, output_dir):
     process_time = time.time() - start_time
     
     # Generate output document
-    doc1_name = os.path.basename(doc1_path)
     doc2_name = os.path.basename(doc2_path)
     output_name = f"output_{doc1_name}_{doc2_name}"
     output_path = os.path.join(documents_dir, output_name)
@@ -66,26 +88,67 @@ def compare_documents(doc1_path, doc2_path, algorithm, output_dir):
         "diff_report": diff_path
     }
 
+# Input document preprocessed once per dataset worker process
+_source_tree = None
+
+def _init_dataset_worker(input_doc, algorithm):
+    """
+    Preprocesses the input document in a dataset worker process.
+    """
+    global _source_tree
+    _source_tree = preproc.preprocess_xml(input_doc, algorithm=algorithm)
+
+def _compare_with_source(input_doc, dataset_file_path, algorithm, analysis_dir, documents_dir,
+                         input_doc_name):
+    """
+    Compares the worker's preprocessed input document against a dataset file.
+    """
+    return _compare_documents_fast(input_doc, dataset_file_path, algorithm, analysis_dir,
+                                   documents_dir, input_doc_name, tree1=_source_tree)
+
 def compare_with_dataset(input_doc, dataset_dir, algorithm, output_dir):
     """
     Compares one document against all documents in a dataset.
     """
     results = []
     
+    # Validated up front, since a parse error in the worker initializer would break the pool
+    if not preproc.validate_xml(input_doc):
+        raise ValueError("Invalid XML document(s)")
+    
+    # Output paths shared by every comparison
+    analysis_dir, documents_dir = _make_output_dirs(output_dir)
+    input_doc_name = os.path.basename(input_doc)
+    
     # Get all XML files in dataset
     dataset_files = [f for f in os.listdir(dataset_dir) if f.endswith('.xml')]
     
+    dataset_paths = []
     for dataset_file in dataset_files:
         dataset_file_path = os.path.join(dataset_dir, dataset_file)
         if dataset_file_path != input_doc:  # Avoid self-comparison
+            dataset_paths.append((dataset_file, dataset_file_path))
+    
+    # Each worker preprocesses the input document once and reuses it across files,
+    # so no more workers are started than there are files to compare
+    max_workers = max(1, min(os.cpu_count() or 1, len(dataset_paths)))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_dataset_worker,
+                             initargs=(input_doc, algorithm)) as executor:
+        futures = {}
+        for dataset_file, dataset_file_path in dataset_paths:
+            future = executor.submit(_compare_with_source, input_doc, dataset_file_path,
+                                     algorithm, analysis_dir, documents_dir, input_doc_name)
+            futures[future] = dataset_file
+        
+        # Collected in submission order so output does not depend on worker timing
+        for future, dataset_file in futures.items():
             try:
-                result = compare_documents(input_doc, dataset_file_path, algorithm, output_dir)
-                results.append(result)
+                results.append(future.result())
             except Exception as e:
                 print(f"Error processing {dataset_file}: {str(e)}")
     
-    # Sort results by edit script size
-    results.sort(key=lambda x: x['edit_script_size'])
+    # Sort results by edit script size, then by document for equal sizes
+    results.sort(key=lambda x: (x['edit_script_size'], x['document2']))
     return results
 
 def main():
@@ -3,45 +3,58 @@ Module for converting processed tree structures back to XML format.
 Supports output from both Nierman-Jagadish and Wagner-Fisher algorithms.
 """
 
-import xml.etree.ElementTree as ET
 from lxml import etree
 
 def post(arr, algorithm='nierman', output_file="myfile.xml"):
     """
     Converts processed tree array back into XML format.
+    Accepts a list of nodes, or a list of subtrees as returned by patch.
     """
-    xml_elements = []
-    current_length = len(xml_elements)
+    # (depth, element) pairs along the path from the root to the last node
+    parent_stack = []
 
-    for node in arr:
+    for node in iterNodes(arr):
         # Extract basic node information
-        parent_tag, node_tag = node[0], node[1]
+        parent_tag, node_tag, depth = node[0], node[1], node[2]
+        
+        # Terminal nodes only mark leaves and have no XML counterpart
+        if node_tag == "0":
+            continue
         
         if parent_tag == "0":
-            root = ET.Element(node_tag)
-            parent = root
-            xml_elements.append(parent)
+            element = root = etree.Element(node_tag)
+            parent_stack = []
         else:
-            # Find correct parent
-            if node[0] == xml_elements[current_length - 1].tag:
-                parent = xml_elements[current_length - 1]
-            else:
-                parent_index = current_length - 1
-                while node[0] != xml_elements[parent_index].tag:
-                    parent_index -= 1
-                parent = xml_elements[parent_index]
+            # Find correct parent: the closest open element above this depth
+            while parent_stack[-1][0] >= depth:
+                parent_stack.pop()
+            parent = parent_stack[-1][1]
             
-            # Create element and handle algorithm-specific data
-            child_element = ET.SubElement(parent, node_tag)
-            if algorithm == 'wagner' and len(node) > 3:
-                child_element.text = node[3]
-            xml_elements.append(child_element)
+            # Attribute nodes carry [name, value] and belong to the open element
+            if isinstance(node_tag, list):
+                parent.set(node_tag[0], node_tag[1])
+                continue
             
-        current_length = len(xml_elements)
+            element = etree.SubElement(parent, node_tag)
+        
+        # Handle algorithm-specific data
+        if algorithm == 'wagner' and len(node) > 3 and node[3]:
+            element.text = node[3]
+        parent_stack.append((depth, element))
 
     # Write to file
-    tree = ET.ElementTree(root)
-    tree.write(output_file, encoding="unicode", xml_declaration=True, pretty_print=True)
+    tree = etree.ElementTree(root)
+    tree.write(output_file, encoding="utf-8", xml_declaration=True, pretty_print=True)
+
+def iterNodes(arr):
+    """
+    Yields the nodes of a tree, flattening subtrees if arr is a list of them.
+    """
+    for item in arr:
+        if len(item) and isinstance(item[0], list):
+            yield from item
+        else:
+            yield item
 
 def print_xml_tree(root, level=0):
     """Helper function to print XML tree structure."""
@@ -60,15 +73,20 @@ def format_xml(input_file, output_file=None):
     tree = etree.parse(input_file, parser)
     tree.write(output_file, pretty_print=True, encoding='unicode')
 
+# Diff report line per edit operation, given (source, target)
+_DIFF_FORMATS = {
+    'update': lambda source, target: f"Update: {source[1]} -> {target[1]}\n",
+    'delete': lambda source, target: f"Delete: {source[1]}\n",
+    'insert': lambda source, target: f"Insert: {target[1]}\n",
+}
+
 def generate_diff_report(edit_script, output_file="diff_report.txt"):
     """
     Generates a human-readable diff report from edit script.
     """
-    with open(output_file, 'w') as f:
-        for operation, source, target in edit_script:
-            if operation == 'update':
-                f.write(f"Update: {source[1]} -> {target[1]}\n")
-            elif operation == 'delete':
-                f.write(f"Delete: {source[1]}\n")
-            elif operation == 'insert':
-                f.write(f"Insert: {target[1]}\n")
\ No newline at end of file
+    lines = [_DIFF_FORMATS[operation](source, target)
+             for operation, source, target in edit_script
+             if operation in _DIFF_FORMATS]
+    
+    with open(output_file, 'w', buffering=1 << 20) as f:
+        f.writelines(lines)
\ No newline at end of file
@@ -3,9 +3,106 @@ Module for preprocessing XML documents into a format suitable for tree compariso
 Supports both Nierman-Jagadish and Wagner-Fisher algorithms.
 """
 
+import sys
+import numpy as np
 from lxml import etree
 
-def preprocess_xml(doc, algorithm='nierman', include_attributes=True):
+# Label id of terminal nodes (and the parent label of the root)
+TERMINAL_ID = 0
+
+class LabelTable:
+    """
+    Interned node labels -> integer ids for the documents of one comparison.
+    Trees are only comparable when they were preprocessed with the same table.
+    Element tags count up from 0, attribute (name, value) pairs count down from -1.
+    """
+    __slots__ = ('label_ids', 'tag_labels', 'attr_labels')
+    
+    def __init__(self):
+        self.label_ids = {}
+        self.tag_labels = []
+        self.attr_labels = []
+        self.labelId("0")
+    
+    def labelId(self, label):
+        """
+        Returns the integer id of a node label, interning it on first use.
+        Attribute labels are [name, value] lists and get negative ids.
+        """
+        key = tuple(label) if isinstance(label, list) else label
+        label_id = self.label_ids.get(key)
+        if label_id is None:
+            if isinstance(key, tuple):
+                self.attr_labels.append(key)
+                label_id = -len(self.attr_labels)
+            else:
+                key = sys.intern(key)
+                label_id = len(self.tag_labels)
+                self.tag_labels.append(key)
+            self.label_ids[key] = label_id
+        return label_id
+    
+    def labelOf(self, label_id):
+        """
+        Returns the node label for an id, as it appears in node lists.
+        """
+        if label_id < 0:
+            return list(self.attr_labels[-label_id - 1])
+        return self.tag_labels[label_id]
+    
+    def copy(self):
+        """
+        Returns an independent table holding the same ids, so trees built with
+        this table stay valid while the copy interns labels of another document.
+        """
+        table = LabelTable.__new__(LabelTable)
+        table.label_ids = dict(self.label_ids)
+        table.tag_labels = list(self.tag_labels)
+        table.attr_labels = list(self.attr_labels)
+        return table
+
+class Tree:
+    """
+    Processed tree structure stored as parallel arrays, one entry per node.
+    
+    Indexing with an int returns the node as [parent_tag, tag, depth] (plus
+    text for Wagner-Fisher); slicing returns a Tree over views of the arrays.
+    """
+    __slots__ = ('parent_ids', 'tag_ids', 'depths', 'text', 'labels')
+    
+    def __init__(self, parent_ids, tag_ids, depths, text=None, labels=None):
+        self.parent_ids = parent_ids
+        self.tag_ids = tag_ids
+        self.depths = depths
+        self.text = text
+        self.labels = labels
+    
+    def __len__(self):
+        return self.depths.size
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Tree(self.parent_ids[index], self.tag_ids[index], self.depths[index],
+                        self.text[index] if self.text is not None else None, self.labels)
+        
+        labelOf = self.labels.labelOf
+        node = [labelOf(self.parent_ids[index]), labelOf(self.tag_ids[index]), int(self.depths[index])]
+        if self.text is not None:
+            node.append(self.text[index])
+        return node
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def __repr__(self):
+        return repr(self.tolist())
+    
+    def tolist(self):
+        """Returns the tree as a list of node lists."""
+        return list(self)
+
+def preprocess_xml(doc, algorithm='nierman', include_attributes=True, labels=None):
     """
     Preprocesses an XML document into a tree structure.
     
@@ -13,47 +110,65 @@ def preprocess_xml(doc, algorithm='nierman', include_attributes=True):
         doc: Path to XML document
         algorithm: 'nierman' or 'wagner' - determines preprocessing approach
         include_attributes: Whether to include XML attributes
+        labels: LabelTable shared with the trees this one is compared to;
+            a new table is created if omitted
     
     Returns:
-        list: Processed tree structure
+        Tree: Processed tree structure
     """
-    tree = etree.parse(doc)
-    root = tree.getroot()
-    arr = []
+    if labels is None:
+        labels = LabelTable()
+    labelId = labels.labelId
+    parent_ids, tag_ids, depths = [], [], []
+    text = [] if algorithm == 'wagner' else None
+    # Open elements as [tag id, depth, node index, has_children]
+    stack = []
     
-    def process_element(element, parent_tag="0", current_depth=0):
-        # Base node information
-        node_info = [parent_tag, element.tag, current_depth]
-        
-        # Add extra information for Wagner-Fisher if needed
-        if algorithm == 'wagner':
-            # Add text content if available for string comparison
-            node_info.append(element.text if element.text and element.text.strip() else '')
+    def add_node(parent_id, tag_id, depth, node_text=''):
+        parent_ids.append(parent_id)
+        tag_ids.append(tag_id)
+        depths.append(depth)
+        if text is not None:
+            text.append(node_text)
+    
+    for event, element in etree.iterparse(doc, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            parent_id, current_depth = TERMINAL_ID, 0
+            if stack:
+                parent_id, current_depth = stack[-1][0], stack[-1][1] + 1
+                stack[-1][3] = True
             
-        arr.append(node_info)
-        
-        # Process attributes
-        if include_attributes and element.attrib:
-            for attr_name, attr_value in element.attrib.items():
-                attr_node = [element.tag, [attr_name, attr_value], current_depth + 1]
-                if algorithm == 'wagner':
-                    attr_node.append(attr_value)
-                arr.append(attr_node)
-        
-        # Process children
-        has_children = False
-        for child in element:
-            has_children = True
-            process_element(child, element.tag, current_depth + 1)
+            # Base node information; for Wagner-Fisher the text is only
+            # guaranteed once the element ends, so it is filled in below
+            tag_id = labelId(element.tag)
+            stack.append([tag_id, current_depth, len(depths), False])
+            add_node(parent_id, tag_id, current_depth)
+            
+            # Process attributes
+            if include_attributes and element.attrib:
+                for attr_name, attr_value in element.attrib.items():
+                    add_node(tag_id, labelId([attr_name, attr_value]), current_depth + 1, attr_value)
+        else:
+            tag_id, current_depth, index, has_children = stack.pop()
             
-        if not has_children:
-            terminal_node = [element.tag, "0", current_depth + 1]
-            if algorithm == 'wagner':
-                terminal_node.append('')
-            arr.append(terminal_node)
-    
-    process_element(root)
-    return arr
+            if text is not None:
+                # Add text content if available for string comparison
+                text[index] = element.text if element.text and element.text.strip() else ''
+                
+            if not has_children:
+                add_node(tag_id, TERMINAL_ID, current_depth + 1)
+            
+            # Release the finished element and any siblings already processed
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+    
+    return Tree(np.array(parent_ids, dtype=np.int32),
+                np.array(tag_ids, dtype=np.int32),
+                np.array(depths, dtype=np.int16),
+                text, labels)
 
 def print_tree(elements, algorithm='nierman'):
     """
@@ -75,7 +190,8 @@ def validate_xml(doc):
     Validates XML document structure.
     """
     try:
-        etree.parse(doc)
+        for _, element in etree.iterparse(doc, events=('end',), huge_tree=True):
+            element.clear()
         return True
     except etree.XMLSyntaxError:
         return False
@@ -84,12 +200,8 @@ def get_tree_stats(elements):
     """
     Returns basic statistics about the tree structure.
     """
-    max_depth = max(elem[2] for elem in elements)
-    node_count = len(elements)
-    leaf_nodes = sum(1 for elem in elements if elem[1] == "0")
-    
     return {
-        'max_depth': max_depth,
-        'total_nodes': node_count,
-        'leaf_nodes': leaf_nodes
+        'max_depth': int(elements.depths.max()),
+        'total_nodes': int(elements.depths.size),
+        'leaf_nodes': int((elements.tag_ids == TERMINAL_ID).sum())
     }
\ No newline at end of file
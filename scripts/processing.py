@@ -3,9 +3,10 @@ Core module for tree comparison and edit script generation.
 Implements both Nierman-Jagadish and Wagner-Fisher algorithms.
 """
 
-from collections import OrderedDict
+from collections import deque
+import functools
 import numpy as np
-import copy
+from numba import njit, prange
 import postprocessing as postproc
 
 def wagnerFisher(stringA, stringB):
@@ -15,133 +16,206 @@ def wagnerFisher(stringA, stringB):
     wordsA = stringA.split() if isinstance(stringA, str) else []
     wordsB = stringB.split() if isinstance(stringB, str) else []
     
-    M = len(wordsA)
-    N = len(wordsB)
-    Dist = [[0 for x in range(N+1)] for y in range(M+1)]
+    # Words are compared by id and length inside the compiled fill
+    word_ids = {}
+    idsA = np.array([word_ids.setdefault(w, len(word_ids)) for w in wordsA], dtype=np.int32)
+    idsB = np.array([word_ids.setdefault(w, len(word_ids)) for w in wordsB], dtype=np.int32)
+    lensA = np.array([len(w) for w in wordsA], dtype=np.int32)
+    lensB = np.array([len(w) for w in wordsB], dtype=np.int32)
+    
+    Dist = _wf(idsA, idsB, lensA, lensB)
+    return Dist, int(Dist[len(wordsA), len(wordsB)])
+
+@njit(cache=True)
+def _wf(idsA, idsB, lensA, lensB):
+    """
+    Compiled Wagner-Fisher matrix fill over word ids and word lengths.
+    Updating a word costs 1 if it is unchanged and the length difference
+    otherwise; inserting or deleting a word costs its length.
+    """
+    M = idsA.shape[0]
+    N = idsB.shape[0]
+    Dist = np.zeros((M+1, N+1), dtype=np.int64)
     
-    Dist[0][0] = 0
     for i in range(1, M+1):
-        Dist[i][0] = Dist[i-1][0] + len(wordsA[i-1])
+        Dist[i, 0] = Dist[i-1, 0] + lensA[i-1]
     for j in range(1, N+1):
-        Dist[0][j] = Dist[0][j-1] + len(wordsB[j-1])
+        Dist[0, j] = Dist[0, j-1] + lensB[j-1]
     
-    for i in range(1, M + 1):
-        for j in range(1, N + 1):
-            Dist[i][j] = min(
-                Dist[i-1][j-1] + wfCostUpdate(wordsA[i-1], wordsB[j-1]),
-                Dist[i-1][j] + len(wordsA[i-1]),
-                Dist[i][j-1] + len(wordsB[j-1])
-            )
+    for i in range(1, M+1):
+        for j in range(1, N+1):
+            update = 1 if idsA[i-1] == idsB[j-1] else abs(lensA[i-1] - lensB[j-1])
+            Dist[i, j] = min(Dist[i-1, j-1] + update,
+                             Dist[i-1, j] + lensA[i-1],
+                             Dist[i, j-1] + lensB[j-1])
     
-    return Dist, Dist[M][N]
+    return Dist
 
-def wfCostUpdate(wordA, wordB):
-    """Helper function for Wagner-Fisher string comparison."""
-    if wordA == wordB:
-        return 1
-    else:
-        return abs(len(str(wordA)) - len(str(wordB)))
+@functools.lru_cache(maxsize=65536)
+def _wf_cached(stringA, stringB):
+    """
+    Wagner-Fisher distance between two strings, cached for repeated text pairs.
+    """
+    return wagnerFisher(stringA, stringB)[1]
 
 def subTrees(tree, subTrees):
     """
     Extracts all subtrees from the input tree structure.
     """
-    current_subtree = []
-    current_level = tree[0][2]
-    
-    for node in tree:
-        if node[2] >= current_level:
-            current_subtree.append(node)
-        else:
-            if current_subtree:
-                subTrees.append(current_subtree)
-            current_subtree = [node]
-            current_level = node[2]
-    
-    if current_subtree:
-        subTrees.append(current_subtree)
+    starts, ends = subTreeOffsets(tree)
+    subTrees.extend(tree[start:end] for start, end in zip(starts, ends))
+
+def subTreeOffsets(tree):
+    """
+    Returns the start and end offsets of the subtrees of a tree, so subtree k
+    is tree[starts[k]:ends[k]]. A subtree starts at every node shallower than
+    all nodes before it.
+    """
+    depths = tree.depths
+    boundary = np.flatnonzero(depths[1:] < np.minimum.accumulate(depths)[:-1]) + 1
+    starts = np.concatenate(([0], boundary))
+    ends = np.concatenate((boundary, [len(depths)]))
+    return starts, ends
 
 def rename(trees, index, parent, prefix, dictionary):
     """
     Renames tree nodes with unique identifiers.
+    Each tree becomes a child of the closest preceding tree rooted at a smaller depth.
     """
-    if index >= len(trees):
-        return
+    # (root depth, name) of the trees enclosing the current one
+    stack = []
+    
+    for i in range(index, len(trees)):
+        current_tree = trees[i]
+        depth = current_tree.depths[0]
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        tree_parent = stack[-1][1] if stack else parent
+        new_name = f"{prefix}{i}"
         
-    current_tree = trees[index]
-    new_name = f"{prefix}{index}"
+        dictionary[new_name] = {
+            'parent': tree_parent,
+            'tree': current_tree,
+            'children': []
+        }
+        
+        if tree_parent:
+            dictionary[tree_parent]['children'].append(new_name)
+        stack.append((depth, new_name))
+
+def calculateCosts(dict_source, trees_target, dict_costs):
+    """
+    Calculates transformation costs between trees sharing a label table.
+    Costs are keyed by source name, then by the index of the target tree.
+    """
+    keys = list(dict_source)
+    sources = [dict_source[key]['tree'].tag_ids for key in keys]
+    targets = [target_tree.tag_ids for target_tree in trees_target]
+    
+    costs = pairCosts(sources, targets)
     
-    dictionary[new_name] = {
-        'parent': parent,
-        'tree': current_tree,
-        'children': []
-    }
+    for i, key in enumerate(keys):
+        dict_costs[key] = dict(enumerate(costs[i].tolist()))
+
+def pairCosts(sources, targets):
+    """
+    Returns the matrix of tree distances between label id arrays.
+    Identical label sequences are computed once.
+    """
+    src_index, unique_src = uniqueIds(sources)
+    tgt_index, unique_tgt = uniqueIds(targets)
     
-    if parent:
-        dictionary[parent]['children'].append(new_name)
+    a_buf, a_off = packTrees(unique_src)
+    b_buf, b_off = packTrees(unique_tgt)
+    out = np.empty((len(unique_src), len(unique_tgt)))
+    _all_pair_costs(a_buf, a_off, b_buf, b_off, out)
     
-    for i in range(index + 1, len(trees)):
-        if trees[i][0][2] > current_tree[0][2]:
-            rename(trees, i, new_name, prefix, dictionary)
-        else:
-            break
+    return out[np.ix_(src_index, tgt_index)]
 
-def calculateCosts(dict_source, trees_target, dict_costs):
+def uniqueIds(id_arrays):
     """
-    Calculates transformation costs between trees.
+    Deduplicates label id arrays by their exact contents.
+    Returns the index of each array into the unique list, and that list.
     """
-    for key in dict_source:
-        dict_costs[key] = {}
-        source_tree = dict_source[key]['tree']
-        
-        for target_tree in trees_target:
-            cost = treeDist(source_tree, target_tree)
-            dict_costs[key][str(target_tree)] = cost
+    positions = {}
+    unique = []
+    index = np.empty(len(id_arrays), dtype=np.int64)
+    for k, ids in enumerate(id_arrays):
+        key = ids.tobytes()
+        if key not in positions:
+            positions[key] = len(unique)
+            unique.append(ids)
+        index[k] = positions[key]
+    return index, unique
+
+def packTrees(id_arrays):
+    """
+    Packs label id arrays into one flat buffer with CSR-style offsets,
+    so array k is buf[offsets[k]:offsets[k+1]].
+    """
+    offsets = np.zeros(len(id_arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in id_arrays])
+    if not id_arrays:
+        return np.empty(0, dtype=np.int32), offsets
+    return np.concatenate(id_arrays), offsets
+
+@njit(cache=True, parallel=True)
+def _all_pair_costs(a_buf, a_off, b_buf, b_off, out):
+    """
+    Fills out[i, j] with the tree distance between packed trees i and j.
+    """
+    for i in prange(a_off.shape[0] - 1):
+        for j in range(b_off.shape[0] - 1):
+            if a_off[i+1] == a_off[i] or b_off[j+1] == b_off[j]:
+                out[i, j] = np.inf
+            else:
+                out[i, j] = _tree_dist(a_buf[a_off[i]:a_off[i+1]], b_buf[b_off[j]:b_off[j+1]])
 
 def treeDist(treeA, treeB):
     """
     Calculates the distance between two trees.
+    Both trees must have been preprocessed with the same label table.
     """
     if not treeA or not treeB:
         return float('inf')
-        
-    costMatrix = np.zeros((len(treeA), len(treeB)))
     
-    for i in range(len(treeA)):
-        for j in range(len(treeB)):
-            update_cost = nodeDist(treeA[i], treeB[j])
-            delete_cost = nodeDist(treeA[i], None)
-            insert_cost = nodeDist(None, treeB[j])
-            
-            costMatrix[i][j] = min(update_cost,
-                                 delete_cost + costMatrix[i-1][j] if i > 0 else float('inf'),
-                                 insert_cost + costMatrix[i][j-1] if j > 0 else float('inf'))
-    
-    return costMatrix[-1][-1]
+    return _tree_dist(treeA.tag_ids, treeB.tag_ids)
 
-def nodeDist(nodeA, nodeB):
+@njit(cache=True, fastmath=True)
+def _tree_dist(a_ids, b_ids):
     """
-    Calculates distance between two nodes.
+    Compiled cost matrix fill for treeDist over encoded node ids.
+    Update costs 0/1 depending on label equality, delete and insert cost 1.
     """
-    if nodeA is None or nodeB is None:
-        return 1.0
-        
-    if isinstance(nodeA[1], list) or isinstance(nodeB[1], list):
-        return 0.0 if nodeA[1] == nodeB[1] else 1.0
+    M = a_ids.shape[0]
+    N = b_ids.shape[0]
+    # Only cells (i-1, j) and (i, j-1) are read, so a single row updated
+    # in place holds the previous row to the right of j and the current one left of it
+    row = np.empty(N)
     
-    return 0.0 if nodeA[1] == nodeB[1] else 1.0
+    for i in range(M):
+        for j in range(N):
+            cost = 0.0 if a_ids[i] == b_ids[j] else 1.0
+            if i > 0 and row[j] + 1.0 < cost:
+                cost = row[j] + 1.0
+            if j > 0 and row[j-1] + 1.0 < cost:
+                cost = row[j-1] + 1.0
+            row[j] = cost
+    
+    return row[N-1]
 
 def toList(dictionary):
     """
     Converts tree dictionary to list format.
     """
     result = []
-    stack = [k for k, v in dictionary.items() if not v['parent']]
+    rev_children = {k: v['children'][::-1] for k, v in dictionary.items()}
+    stack = deque(k for k, v in dictionary.items() if not v['parent'])
     
     while stack:
         current = stack.pop()
         result.append(current)
-        stack.extend(reversed(dictionary[current]['children']))
+        stack.extend(rev_children[current])
     
     return result
 
@@ -154,7 +228,9 @@ def generateEditScript(treeA, treeB, algorithm='nierman'):
     def compare_nodes(nodeA, nodeB):
         if nodeA[1] != nodeB[1]:
             if algorithm == 'wagner' and len(nodeA) > 3 and len(nodeB) > 3:
-                dist, _ = wagnerFisher(nodeA[3], nodeB[3])
+                textA, textB = nodeA[3], nodeB[3]
+                dist = _wf_cached(textA if isinstance(textA, str) else '',
+                                  textB if isinstance(textB, str) else '')
                 if dist > 0:
                     edit_script.append(('update', nodeA, nodeB))
             else:
@@ -163,13 +239,16 @@ def generateEditScript(treeA, treeB, algorithm='nierman'):
     def process_trees(dictA, dictB):
         listA = toList(dictA)
         listB = toList(dictB)
+        # Lists keep the traversal order, sets serve the membership tests
+        setA = set(listA)
+        setB = set(listB)
         
         for nodeA in listA:
-            if nodeA not in listB:
+            if nodeA not in setB:
                 edit_script.append(('delete', dictA[nodeA]['tree'], None))
         
         for nodeB in listB:
-            if nodeB not in listA:
+            if nodeB not in setA:
                 edit_script.append(('insert', None, dictB[nodeB]['tree']))
             else:
                 compare_nodes(dictA[nodeA]['tree'], dictB[nodeB]['tree'])
@@ -181,8 +260,6 @@ def run(tree1, tree2, algorithm='nierman'):
     """
     Main entry point for tree comparison.
     """
-    global dictA, dictB, subTreesA, subTreesB, dictCostsA, dictCostsB, ListofTreesA, ListofTreesB
-    
     # Initialize structures
     dictA, dictB = {}, {}
     subTreesA, subTreesB = [], []
@@ -193,15 +270,6 @@ def run(tree1, tree2, algorithm='nierman'):
     rename(subTreesA, 0, '', 'A', dictA)
     rename(subTreesB, 0, '', 'B', dictB)
     
-    # Calculate costs
-    dictCostsA, dictCostsB = {}, {}
-    calculateCosts(dictA, subTreesB, dictCostsA)
-    calculateCosts(dictB, subTreesA, dictCostsB)
-    
-    # Generate final lists
-    ListofTreesA = toList(dictA)
-    ListofTreesB = toList(dictB)
-    
     # Generate and return edit script
     return generateEditScript(dictA, dictB, algorithm)
 